@@ -14,23 +14,121 @@ Usage:
   python generate_plan.py --file_path data/12_Why_Cannot_Transformers_Learn_Multiplication-Reverse-Engineering_Reveals_Long-Range_Dependency_Pitfalls.pdf --out_dir experiments_human_repo/12_Why_Cannot_Transformers_Learn_Multiplication-Reverse-Engineering_Reveals_Long-Range_Dependency_Pitfalls
 
 Optional:
-  python generate_plan.py --file_path paper.pdf --out_dir ./outputs --claude_cmd claude
+  python generate_plan.py --file_path paper.pdf --out_dir ./outputs --model claude-sonnet-4-5
   python generate_plan.py --file_path paper.pdf --out_dir ./outputs --max_words 280
+  python generate_plan.py --file_path paper.pdf --out_dir ./outputs --use_cli --claude_cmd claude
+
+By default the PDF is sent to the Anthropic Messages API (requires `anthropic` and
+ANTHROPIC_API_KEY); the static instructions + schema are sent as a cached system block
+and the plan comes back as structured output through a forced `emit_plan` tool call.
+Pass --use_cli to fall back to the Claude Code CLI reading the PDF from disk.
 """
 
 from __future__ import annotations
 
 import argparse
+import asyncio
+import base64
+import contextlib
+import functools
+import io
 import json
+import mmap
 import os
 import re
+import shlex
 import subprocess
-from typing import Any, Dict, List, Optional
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+try:
+    import orjson
+except ImportError:  # stdlib json fallback
+    orjson = None
+from pydantic import BaseModel, BeforeValidator, ValidationError
+from typing_extensions import Annotated
+
+from plan_cache import PlanCache, make_key, sha256_pdf
+
+# Raw PDF bytes, or a read-only mmap of the file (see open_pdf_bytes).
+PdfBuffer = Union[bytes, mmap.mmap]
 
 
 # ---------------------------
 # Claude invocation
 # ---------------------------
+class AnthropicClient:
+    """
+    Thin wrapper around the Anthropic Messages API.
+
+    The attached PDF carries cache_control, so that breakpoint covers tools, system
+    and PDF: retries and reruns on the same paper (within the cache lifetime) read
+    the whole prefix from cache and pay full input cost only for the short user
+    trailer. The system block keeps its own breakpoint so the static instructions
+    can be shared across papers when they are long enough to be cached.
+    Output is structured: Claude is forced to call the emit_plan tool, whose input
+    arrives as already-parsed JSON, so this path needs no fence stripping or JSON repair.
+    """
+
+    def __init__(self, model: str, max_tokens: int = 8192, timeout_s: int = 1800):
+        import anthropic
+
+        self.client = anthropic.Anthropic(timeout=timeout_s)
+        self.model = model
+        self.max_tokens = max_tokens
+
+    def message_params(self, pdf_bytes: PdfBuffer, user_text: str) -> Dict[str, Any]:
+        """
+        Messages API request body: cached system block, then the PDF as a native
+        (cached) document block followed by the dynamic user text.
+        Shared by generate() and the Message Batches path (generate_plan_batch.py).
+        """
+        return {
+            "model": self.model,
+            "max_tokens": self.max_tokens,
+            "system": SYSTEM_BLOCKS,
+            "tools": [EMIT_PLAN_TOOL],
+            "tool_choice": {"type": "tool", "name": EMIT_PLAN_TOOL["name"]},
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "document",
+                            "source": {
+                                "type": "base64",
+                                "media_type": "application/pdf",
+                                "data": base64.b64encode(pdf_bytes).decode("ascii"),
+                            },
+                            "cache_control": {"type": "ephemeral"},
+                        },
+                        {"type": "text", "text": user_text},
+                    ],
+                }
+            ],
+        }
+
+    def generate(self, pdf_bytes: PdfBuffer, user_text: str) -> Dict[str, Any]:
+        """
+        Single synchronous call; returns the emit_plan tool input.
+        """
+        msg = self.client.messages.create(**self.message_params(pdf_bytes, user_text))
+        return message_plan_input(msg)
+
+
+def message_plan_input(msg: Any) -> Dict[str, Any]:
+    """
+    Pull the emit_plan tool input out of a Messages API response.
+    Raises ValueError (retried with feedback) if the plan is missing or truncated.
+    """
+    if msg.stop_reason == "max_tokens":
+        raise ValueError("the plan was cut off at max_tokens; keep it more concise")
+    for b in msg.content:
+        if b.type == "tool_use" and b.name == EMIT_PLAN_TOOL["name"]:
+            return b.input
+    raise ValueError(f"no {EMIT_PLAN_TOOL['name']} tool call in the response")
+
+
 def run_claude(
     claude_cmd: str,
     prompt: str,
@@ -45,6 +143,10 @@ def run_claude(
       uses the simplest universally available pattern: send prompt via stdin.
     - If your Claude CLI requires extra flags, pass them via --claude_cmd as a string,
       e.g. --claude_cmd "claude --dangerously-allow-file-access" (if applicable in your setup).
+    - One process per prompt is deliberate. The CLI has no framed multi-prompt stdio mode;
+      its stream-json input keeps a single conversation, so a long-lived worker would leak
+      one paper's context into the next. Startup cost is negligible next to the PDF read +
+      generation; for many papers use run_claude_async / generate_plan_batch.py instead.
     """
     # Allow claude_cmd to include extra args; split safely.
     cmd_parts = split_shell_like(claude_cmd)
@@ -67,29 +169,91 @@ def run_claude(
     return proc.stdout.strip()
 
 
-def split_shell_like(s: str) -> List[str]:
+async def run_claude_async(
+    claude_cmd: str,
+    prompt: str,
+    timeout_s: int = 1800,
+) -> str:
+    """
+    Async twin of run_claude for fanning out many CLI calls concurrently
+    (see process_many in generate_plan_batch.py).
+    """
+    cmd_parts = split_shell_like(claude_cmd)
+
+    proc = await asyncio.create_subprocess_exec(
+        *cmd_parts,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout_b, stderr_b = await asyncio.wait_for(proc.communicate(prompt.encode("utf-8")), timeout=timeout_s)
+    finally:
+        # Timeout, cancellation (gather abort, Ctrl-C, asyncio.run teardown): never
+        # leave the CLI process running behind us.
+        if proc.returncode is None:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+    stdout = stdout_b.decode("utf-8", errors="replace")
+    stderr = stderr_b.decode("utf-8", errors="replace")
+    if proc.returncode != 0:
+        raise RuntimeError(
+            "Claude CLI failed.\n"
+            f"Command: {claude_cmd}\n"
+            f"Return code: {proc.returncode}\n"
+            f"STDERR:\n{stderr.strip()}\n"
+            f"STDOUT:\n{stdout.strip()}\n"
+        )
+    return stdout.strip()
+
+
+@functools.lru_cache(maxsize=8)
+def split_shell_like(s: str) -> Tuple[str, ...]:
     """
     Minimal shell-like splitting (handles quoted substrings).
-    Avoids requiring shlex edge-cases; good enough for typical commands.
+    Cached per command string since batch runs split the same --claude_cmd for every
+    paper; returns a tuple so the cached value cannot be mutated by callers.
     """
-    import shlex
-    return shlex.split(s)
+    return tuple(shlex.split(s))
 
 
 # ---------------------------
 # JSON parsing helpers
 # ---------------------------
+_FENCE_OPEN = re.compile(r"^```[a-zA-Z]*\n")
+_FENCE_CLOSE = re.compile(r"\n```$")
+_WS = re.compile(r"\s+")
+
+
 def parse_json_strict(text: str) -> Dict[str, Any]:
     """
-    Parse JSON output. If wrapped in code fences, strip them.
+    Parse JSON output (CLI path only). If wrapped in code fences, strip them.
     """
     t = text.strip()
     if t.startswith("```"):
-        t = re.sub(r"^```[a-zA-Z]*\n", "", t)
-        t = re.sub(r"\n```$", "", t).strip()
+        t = _FENCE_OPEN.sub("", t)
+        t = _FENCE_CLOSE.sub("", t).strip()
+    if orjson is not None:
+        return orjson.loads(t)
     return json.loads(t)
 
 
+def dumps_indented(obj: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode("utf-8")
+    return json.dumps(obj, indent=2)
+
+
+def parse_plan(text: str) -> Plan:
+    """
+    Parse Claude's output into a validated Plan.
+    """
+    return Plan.model_validate(parse_json_strict(text))
+
+
 def normalize_unknown(x: Any) -> str:
     """
     Normalize unknown-ish values to "Unknown".
@@ -106,84 +270,256 @@ def normalize_unknown(x: Any) -> str:
     return str(x)
 
 
+def normalize_quote(q: Optional[str]) -> str:
+    q = (q or "").strip()
+    if not q:
+        return ""
+    # Collapse whitespace and keep it short in output files: at most 41 pieces,
+    # the last holding the untokenized remainder past word 40.
+    toks = _WS.split(q, maxsplit=40)
+    if len(toks) > 40:
+        return " ".join(toks[:40]) + "..."
+    return " ".join(toks)
+
+
 # ---------------------------
-# Prompting
+# Plan model
 # ---------------------------
-def build_plan_prompt(pdf_path: str, max_words: int) -> str:
-    """
-    Ask Claude to read the PDF directly from local path and output a JSON plan.
-    We request evidence + unknowns in the JSON; we'll render two markdown files later.
-    """
-    schema = {
-        "objective": {
-            "text": "string|Unknown",
-            "evidence": [{"page": "int", "quote": "string"}]
-        },
-        "hypothesis": {
-            "items": [
-                {"text": "string", "evidence": [{"page": "int", "quote": "string"}]}
-            ],
-            "Unknown_if_missing": True
-        },
-        "methodology": {
-            "items": [
-                {"text": "string", "evidence": [{"page": "int", "quote": "string"}]}
-            ],
-            "Unknown_if_missing": True
-        },
-        "experiments": {
-            "items": [
-                {
-                    "name": "string",
-                    "what_varied": "string|Unknown",
-                    "metric": "string|Unknown",
-                    "main_result": "string|Unknown",
-                    "evidence": [{"page": "int", "quote": "string"}]
-                }
-            ],
-            "Unknown_if_missing": True
-        },
-        "unknowns": ["string"]
-    }
+# Validated once after parsing; the renderers then read attributes directly.
+# Validators are lenient on purpose: a section given as "Unknown", a non-list items
+# field or a non-dict entry degrades to empty instead of failing the whole plan.
+def _opt_str(v: Any) -> Optional[str]:
+    if v is None or isinstance(v, str):
+        return v
+    return str(v)
+
+
+def _quote(v: Any) -> str:
+    return normalize_quote(_opt_str(v))
+
+
+def _int_or_none(v: Any) -> Optional[int]:
+    return v if isinstance(v, int) else None
+
+
+def _dict_or_empty(v: Any) -> Dict[str, Any]:
+    return v if isinstance(v, dict) else {}
+
+
+def _list_or_empty(v: Any) -> List[Any]:
+    return v if isinstance(v, list) else []
+
+
+def _dicts_only(v: Any) -> List[Dict[str, Any]]:
+    return [x for x in v if isinstance(x, dict)] if isinstance(v, list) else []
+
+
+# Normalized once at validation time; renderers compare against "Unknown" directly.
+UnknownText = Annotated[str, BeforeValidator(normalize_unknown)]
 
-    # The concise plan.md will be rendered to contain ONLY the four sections, no evidence/unknowns.
-    # This prompt enforces: if missing => Unknown, and we keep methodology non-trivial.
-    prompt = f"""
+
+class Evidence(BaseModel):
+    page: Annotated[Optional[int], BeforeValidator(_int_or_none)] = None
+    # Whitespace-collapsed and capped at 40 words at validation time.
+    quote: Annotated[str, BeforeValidator(_quote)] = ""
+
+
+EvidenceList = Annotated[List[Evidence], BeforeValidator(_dicts_only)]
+
+
+class Item(BaseModel):
+    text: UnknownText = "Unknown"
+    evidence: EvidenceList = []
+
+
+class Experiment(BaseModel):
+    name: UnknownText = "Unknown"
+    what_varied: UnknownText = "Unknown"
+    metric: UnknownText = "Unknown"
+    main_result: UnknownText = "Unknown"
+    evidence: EvidenceList = []
+
+
+class ObjectiveBlock(BaseModel):
+    text: UnknownText = "Unknown"
+    evidence: EvidenceList = []
+
+
+class ListBlock(BaseModel):
+    items: Annotated[List[Item], BeforeValidator(_dicts_only)] = []
+
+
+class ExperimentsBlock(BaseModel):
+    items: Annotated[List[Experiment], BeforeValidator(_dicts_only)] = []
+
+
+class Plan(BaseModel):
+    objective: Annotated[ObjectiveBlock, BeforeValidator(_dict_or_empty)] = ObjectiveBlock()
+    hypothesis: Annotated[ListBlock, BeforeValidator(_dict_or_empty)] = ListBlock()
+    methodology: Annotated[ListBlock, BeforeValidator(_dict_or_empty)] = ListBlock()
+    experiments: Annotated[ExperimentsBlock, BeforeValidator(_dict_or_empty)] = ExperimentsBlock()
+    unknowns: Annotated[List[UnknownText], BeforeValidator(_list_or_empty)] = []
+
+
+# ---------------------------
+# Prompting
+# ---------------------------
+# Bump PROMPT_VERSION whenever the prompt text changes (new cache keys), and
+# PLAN_SCHEMA_VERSION whenever the parsed plan structure changes (evicts old entries).
+PROMPT_VERSION = "5"
+PLAN_SCHEMA_VERSION = "1"
+
+PLAN_SCHEMA: Dict[str, Any] = {
+    "objective": {
+        "text": "string|Unknown",
+        "evidence": [{"page": "int", "quote": "string"}]
+    },
+    "hypothesis": {
+        "items": [
+            {"text": "string", "evidence": [{"page": "int", "quote": "string"}]}
+        ],
+        "Unknown_if_missing": True
+    },
+    "methodology": {
+        "items": [
+            {"text": "string", "evidence": [{"page": "int", "quote": "string"}]}
+        ],
+        "Unknown_if_missing": True
+    },
+    "experiments": {
+        "items": [
+            {
+                "name": "string",
+                "what_varied": "string|Unknown",
+                "metric": "string|Unknown",
+                "main_result": "string|Unknown",
+                "evidence": [{"page": "int", "quote": "string"}]
+            }
+        ],
+        "Unknown_if_missing": True
+    },
+    "unknowns": ["string"]
+}
+
+PLAN_SCHEMA_JSON = dumps_indented(PLAN_SCHEMA)
+
+# Static content rules shared by both paths. Each path appends its own static output
+# contract (JSON text for the CLI, the emit_plan tool for the Messages API), and the
+# result is placed FIRST in every request so prefix-based prompt caching can serve it:
+# the cached system block on the Messages API path, and the head of the stdin payload
+# on the CLI path. Everything paper-specific (PDF, path, max_words) comes after, in a
+# short trailer.
+# The concise plan.md will be rendered to contain ONLY the four sections, no evidence/unknowns.
+# These instructions keep methodology non-trivial; missing sections follow the output contract.
+PLAN_INSTRUCTIONS = """
 You are generating a structured Plan for a mechanistic interpretability paper to be evaluated by a standardized pipeline.
 
-You MUST read the PDF directly from this local path:
-{pdf_path}
+The paper PDF and the word budget (max_words) are given after these instructions.
 
 Hard constraints:
 1) ONLY use information from the PDF. Do NOT use external knowledge.
-2) Output MUST be valid JSON ONLY. No markdown, no commentary.
-3) The final plan must be concise:
-   - Keep the combined length of objective+hypothesis+methodology+experiments summaries within ~{max_words} words.
+2) The final plan must be concise:
+   - Keep the combined length of objective+hypothesis+methodology+experiments summaries within ~max_words words.
    - Methodology must not be empty or too shallow: include the core approach, model/data setting if stated, key analysis/intervention techniques, and how claims are tested.
-4) The output must have EXACTLY these four content sections:
+3) The output must have EXACTLY these four content sections:
    - objective
    - hypothesis
    - methodology
    - experiments
-   If a section cannot be found from the PDF, set it explicitly to "Unknown" (or empty items with Unknown_if_missing honored).
-5) Evidence:
+   If a section cannot be found from the PDF, mark it missing as the output format below says.
+4) Evidence:
    - For each hypothesis/methodology item and each experiment entry, include at least one evidence quote with page number.
    - Quotes must be short (<= 35 words) and plausibly verbatim from the PDF.
-6) Experiments must be a separate section (NOT nested under methodology). Provide 2-6 experiments if present, else Unknown.
-7) Add an "unknowns" list for important missing details that a reproducer/evaluator would want but the PDF does not specify.
+5) Experiments must be a separate section (NOT nested under methodology). Provide 2-6 experiments if present.
+6) Add an "unknowns" list for important missing details that a reproducer/evaluator would want but the PDF does not specify.
+""".strip()
+
+# Output contract for the CLI path, which parses the reply text as JSON.
+CLI_PLAN_INSTRUCTIONS = f"""
+{PLAN_INSTRUCTIONS}
+
+Output format:
+- Output MUST be valid JSON ONLY. No markdown, no commentary.
+- If a section cannot be found from the PDF, set it explicitly to "Unknown" (or empty items with Unknown_if_missing honored); with no experiments, set experiments to "Unknown".
 
 Required JSON schema (types + keys). Follow it strictly:
-{json.dumps(schema, indent=2)}
+{PLAN_SCHEMA_JSON}
+""".strip()
 
-Now produce the JSON.
+def _require_all_fields(node: Any) -> Any:
+    """
+    Strict copy of a model JSON Schema: every object lists all of its properties as
+    required and field defaults are dropped, so the schema does not invite omissions
+    that the lenient validators would otherwise fill in.
+    """
+    if isinstance(node, list):
+        return [_require_all_fields(x) for x in node]
+    if not isinstance(node, dict):
+        return node
+    out = {k: _require_all_fields(v) for k, v in node.items() if k != "default"}
+    if isinstance(node.get("properties"), dict):
+        # Property names are keys, not schemas; keep them (and a field named "default").
+        out["properties"] = {k: _require_all_fields(v) for k, v in node["properties"].items()}
+        out["required"] = list(node["properties"])
+    return out
+
+
+# Structured output for the Messages API path: the JSON Schema is derived from the
+# Plan model with every field required at every level (the same keys the CLI schema
+# lists). Parsing still goes through the lenient Plan validators.
+PLAN_JSON_SCHEMA: Dict[str, Any] = _require_all_fields(Plan.model_json_schema())
+
+EMIT_PLAN_TOOL: Dict[str, Any] = {
+    "name": "emit_plan",
+    "description": "Return the structured plan for the attached paper.",
+    "input_schema": PLAN_JSON_SCHEMA,
+}
+
+# Output contract for the Messages API path: the forced emit_plan tool call is the
+# only output, and its input schema is the required format.
+API_PLAN_INSTRUCTIONS = f"""
+{PLAN_INSTRUCTIONS}
+
+Output format:
+- Return the plan by calling the emit_plan tool; its input schema is the required format.
+- If a section cannot be found from the PDF, give it an empty items list (objective: text "Unknown", no evidence).
 """.strip()
-    return prompt
+
+SYSTEM_BLOCKS: List[Dict[str, Any]] = [
+    {"type": "text", "text": API_PLAN_INSTRUCTIONS, "cache_control": {"type": "ephemeral"}}
+]
+
+
+def build_plan_user_text(pdf_path: str, max_words: int) -> str:
+    """
+    Dynamic trailer for the Messages API request (the PDF itself is attached as a
+    document block just before it).
+    """
+    return (
+        f"PDF file: {os.path.basename(pdf_path)} (attached)\n"
+        f"max_words: {max_words}\n"
+        "Now produce the plan by calling emit_plan."
+    )
+
+
+def build_plan_prompt(pdf_path: str, max_words: int) -> str:
+    """
+    CLI prompt (--use_cli): the static CLI_PLAN_INSTRUCTIONS first, then a trailer asking
+    Claude to read the PDF directly from its local path.
+    We request evidence + unknowns in the JSON; we'll render two markdown files later.
+    """
+    return (
+        f"{CLI_PLAN_INSTRUCTIONS}\n\n"
+        f"You MUST read the PDF directly from this local path:\n{pdf_path}\n"
+        f"max_words: {max_words}\n"
+        "Now produce the JSON."
+    )
 
 
 # ---------------------------
 # Rendering: two markdown outputs
 # ---------------------------
-def render_plan_md_concise(plan: Dict[str, Any]) -> str:
+def render_plan_md_concise(plan: Plan) -> str:
     """
     Concise plan.md:
     - Only Objective / Hypothesis / Methodology / Experiments
@@ -195,24 +531,21 @@ def render_plan_md_concise(plan: Dict[str, Any]) -> str:
     meth = extract_list_text(plan, "methodology")
     exps = extract_experiments_text(plan, include_evidence=False)
 
-    md = []
-    md.append("# Plan\n")
-    md.append("## Objective\n")
-    md.append(f"{obj}\n\n")
-
-    md.append("## Hypothesis\n")
-    md.append(f"{hyp}\n\n")
-
-    md.append("## Methodology\n")
-    md.append(f"{meth}\n\n")
-
-    md.append("## Experiments\n")
-    md.append(f"{exps}\n")
-
-    return "".join(md)
-
-
-def render_plan_md_with_evidence(plan: Dict[str, Any]) -> str:
+    buf = io.StringIO()
+    w = buf.write
+    w("# Plan\n## Objective\n")
+    w(obj)
+    w("\n\n## Hypothesis\n")
+    w(hyp)
+    w("\n\n## Methodology\n")
+    w(meth)
+    w("\n\n## Experiments\n")
+    w(exps)
+    w("\n")
+    return buf.getvalue()
+
+
+def render_plan_md_with_evidence(plan: Plan) -> str:
     """
     plan_with_evidence.md:
     - Same four sections
@@ -227,144 +560,94 @@ def render_plan_md_with_evidence(plan: Dict[str, Any]) -> str:
     meth_ev_lines = extract_list_evidence_lines(plan, "methodology")
 
     exps_text = extract_experiments_text(plan, include_evidence=True)
-    unknowns = plan.get("unknowns", [])
-    if not isinstance(unknowns, list):
-        unknowns = []
-
-    md = []
-    md.append("# Plan (with evidence)\n")
-
-    md.append("## Objective\n")
-    md.append(f"{obj_text}\n")
-    if obj_ev:
-        md.append("\n**Evidence**:\n")
-        for ln in obj_ev:
-            md.append(f"- {ln}\n")
-    md.append("\n")
-
-    md.append("## Hypothesis\n")
-    md.append(f"{hyp_text}\n")
-    if hyp_ev_lines:
-        md.append("\n**Evidence**:\n")
-        for ln in hyp_ev_lines:
-            md.append(f"- {ln}\n")
-    md.append("\n")
-
-    md.append("## Methodology\n")
-    md.append(f"{meth_text}\n")
-    if meth_ev_lines:
-        md.append("\n**Evidence**:\n")
-        for ln in meth_ev_lines:
-            md.append(f"- {ln}\n")
-    md.append("\n")
-
-    md.append("## Experiments\n")
-    md.append(f"{exps_text}\n")
-
-    md.append("\n## Unknowns\n")
+    unknowns = plan.unknowns
+
+    buf = io.StringIO()
+    w = buf.write
+    w("# Plan (with evidence)\n## Objective\n")
+    w(obj_text)
+    w("\n")
+    _write_evidence(w, obj_ev)
+    w("\n## Hypothesis\n")
+    w(hyp_text)
+    w("\n")
+    _write_evidence(w, hyp_ev_lines)
+    w("\n## Methodology\n")
+    w(meth_text)
+    w("\n")
+    _write_evidence(w, meth_ev_lines)
+    w("\n## Experiments\n")
+    w(exps_text)
+    w("\n\n## Unknowns\n")
     if unknowns:
         for u in unknowns:
-            md.append(f"- {normalize_unknown(u)}\n")
+            w("- ")
+            w(u)
+            w("\n")
     else:
-        md.append("- (none)\n")
+        w("- (none)\n")
+    return buf.getvalue()
 
-    return "".join(md)
 
+def _write_evidence(w: Callable[[str], int], lines: List[str]) -> None:
+    if not lines:
+        return
+    w("\n**Evidence**:\n")
+    for ln in lines:
+        w("- ")
+        w(ln)
+        w("\n")
 
-def extract_objective_text(plan: Dict[str, Any]) -> str:
-    obj = plan.get("objective", {})
-    if isinstance(obj, dict):
-        return normalize_unknown(obj.get("text"))
-    return "Unknown"
 
+def extract_objective_text(plan: Plan) -> str:
+    return plan.objective.text
 
-def extract_objective_with_evidence(plan: Dict[str, Any]) -> (str, List[str]):
-    obj = plan.get("objective", {})
-    text = "Unknown"
-    ev_lines: List[str] = []
-    if isinstance(obj, dict):
-        text = normalize_unknown(obj.get("text"))
-        ev = obj.get("evidence", [])
-        ev_lines = format_evidence_list(ev)
-    return text, ev_lines
 
+def extract_objective_with_evidence(plan: Plan) -> (str, List[str]):
+    return plan.objective.text, [line for _, line in format_evidence_list(plan.objective.evidence)]
 
-def extract_list_text(plan: Dict[str, Any], key: str) -> str:
+
+def extract_list_text(plan: Plan, key: str) -> str:
     """
     For hypothesis/methodology: print numbered list or Unknown.
     """
-    sec = plan.get(key, {})
-    items = []
-    if isinstance(sec, dict):
-        raw_items = sec.get("items", [])
-        if isinstance(raw_items, list):
-            for it in raw_items:
-                if isinstance(it, dict):
-                    t = normalize_unknown(it.get("text"))
-                    if t != "Unknown":
-                        items.append(t)
+    sec: ListBlock = getattr(plan, key)
+    items = [it.text for it in sec.items if it.text != "Unknown"]
     if not items:
         return "Unknown"
-    out = []
-    for i, t in enumerate(items, 1):
-        out.append(f"{i}. {t}\n")
-    return "".join(out).strip()
+    return "\n".join(f"{i}. {t}" for i, t in enumerate(items, 1))
 
 
-def extract_list_evidence_lines(plan: Dict[str, Any], key: str) -> List[str]:
-    sec = plan.get(key, {})
+def extract_list_evidence_lines(plan: Plan, key: str) -> List[str]:
+    """
+    Evidence lines for hypothesis/methodology, capped to 2 per item.
+    """
+    sec: ListBlock = getattr(plan, key)
     lines: List[str] = []
-    if not isinstance(sec, dict):
-        return lines
-    raw_items = sec.get("items", [])
-    if not isinstance(raw_items, list):
-        return lines
-    for idx, it in enumerate(raw_items, 1):
-        if not isinstance(it, dict):
-            continue
-        t = normalize_unknown(it.get("text"))
-        ev = it.get("evidence", [])
-        ev_lines = format_evidence_list(ev)
-        # keep evidence compact: prefix with item number
-        for e in ev_lines[:2]:  # cap 2 evidence lines per item
-            lines.append(f"H{idx if key=='hypothesis' else 'M'+str(idx)} (p.{extract_page(e)}): {e}")
-        # If no evidence, still keep nothing; we don't force here.
-    # If the above prefix is messy, simplify:
-    if lines:
-        # Remove the weird "extract_page" hack; return plain
-        # We'll just return plain evidence lines with (p.X) included by formatter.
-        return [ln.split(": ", 1)[-1] if ": " in ln else ln for ln in lines]
-    return []
-
-
-def extract_experiments_text(plan: Dict[str, Any], include_evidence: bool) -> str:
-    sec = plan.get("experiments", {})
-    if not isinstance(sec, dict):
-        return "Unknown"
-    raw_items = sec.get("items", [])
-    if not isinstance(raw_items, list) or len(raw_items) == 0:
+    for it in sec.items:
+        lines.extend(line for _, line in format_evidence_list(it.evidence)[:2])
+    return lines
+
+
+def extract_experiments_text(plan: Plan, include_evidence: bool) -> str:
+    raw_items = plan.experiments.items
+    if len(raw_items) == 0:
         return "Unknown"
 
     exps = []
     for it in raw_items:
-        if not isinstance(it, dict):
-            continue
-        name = normalize_unknown(it.get("name"))
-        if name == "Unknown":
+        if it.name == "Unknown":
             continue
-        what_varied = normalize_unknown(it.get("what_varied"))
-        metric = normalize_unknown(it.get("metric"))
-        main_result = normalize_unknown(it.get("main_result"))
-        ev_lines = format_evidence_list(it.get("evidence", []))
+        ev_lines = format_evidence_list(it.evidence)
 
         block = []
-        block.append(f"### {name}\n")
-        block.append(f"- What varied: {what_varied}\n")
-        block.append(f"- Metric: {metric}\n")
-        block.append(f"- Main result: {main_result}\n")
+        block.append(f"### {it.name}\n")
+        block.append(f"- What varied: {it.what_varied}\n")
+        block.append(f"- Metric: {it.metric}\n")
+        block.append(f"- Main result: {it.main_result}\n")
         if include_evidence and ev_lines:
             block.append(f"- Evidence:\n")
-            for e in ev_lines[:2]:  # cap evidence per experiment to keep it short
+            for _, e in ev_lines[:2]:  # cap evidence per experiment to keep it short
                 block.append(f"  - {e}\n")
         exps.append("".join(block))
 
@@ -373,51 +656,167 @@ def extract_experiments_text(plan: Dict[str, Any], include_evidence: bool) -> st
     return "\n".join(exps).strip()
 
 
-def format_evidence_list(ev: Any) -> List[str]:
+def format_evidence_list(ev: List[Evidence]) -> List[Tuple[str, str]]:
     """
-    Evidence formatter: "(p.X) "Quote..."" lines.
+    Evidence formatter: (page, "(p.X) "Quote..."") pairs, page "?" when unknown.
+    Quotes arrive already normalized (see Evidence), so this is a single pass.
     """
-    lines: List[str] = []
-    if not isinstance(ev, list):
-        return lines
+    pairs: List[Tuple[str, str]] = []
     for item in ev:
-        if not isinstance(item, dict):
-            continue
-        page = item.get("page", None)
-        quote = item.get("quote", "")
-        quote = normalize_quote(quote)
-        if not quote:
+        if not item.quote:
             continue
-        if isinstance(page, int):
-            lines.append(f"(p.{page}) \"{quote}\"")
-        else:
-            lines.append(f"(p.?) \"{quote}\"")
-    return lines
+        page = "?" if item.page is None else str(item.page)
+        pairs.append((page, f"(p.{page}) \"{item.quote}\""))
+    return pairs
 
 
-def normalize_quote(q: str) -> str:
-    q = (q or "").strip()
-    q = re.sub(r"\s+", " ", q)
-    # keep it short in output files
-    if len(q.split()) > 40:
-        q = " ".join(q.split()[:40]) + "..."
-    return q
+@contextlib.contextmanager
+def open_pdf_bytes(pdf_path: str) -> Iterator[mmap.mmap]:
+    """
+    Map the PDF read-only so hashing (cache key) and base64 encoding (Messages API)
+    share the same kernel pages instead of each needing a full bytes copy.
+    """
+    with open(pdf_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError(f"PDF is empty: {pdf_path}")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield mm
+    finally:
+        mm.close()
+
+
+def plan_output_paths(out_dir: str) -> Tuple[str, str]:
+    return os.path.join(out_dir, "plan.md"), os.path.join(out_dir, "plan_with_evidence.md")
+
+
+def plan_outputs_exist(out_dir: str) -> bool:
+    return all(os.path.exists(p) for p in plan_output_paths(out_dir))
+
+
+def atomic_write(path: str, data: str) -> None:
+    """
+    Write to path + ".tmp" and os.replace it into place, so a crash never leaves a
+    truncated plan file behind (which --skip_existing would then treat as done).
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def write_plan_outputs(plan: Plan, out_dir: str) -> None:
+    """
+    Render plan.md + plan_with_evidence.md into out_dir.
+    """
+    plan_md = render_plan_md_concise(plan)
+    plan_with_evidence_md = render_plan_md_with_evidence(plan)
+
+    out_plan, out_plan_e = plan_output_paths(out_dir)
 
+    atomic_write(out_plan, plan_md)
+    atomic_write(out_plan_e, plan_with_evidence_md)
+
+    print(f"Wrote: {out_plan}")
+    print(f"Wrote: {out_plan_e}")
 
-def extract_page(evidence_line: str) -> str:
-    m = re.search(r"\(p\.(\d+)\)", evidence_line)
-    return m.group(1) if m else "?"
+
+def load_cached_plan(cache: PlanCache, key: str) -> Optional[Plan]:
+    """
+    Cache lookup + re-validation; entries that no longer validate are evicted.
+    """
+    raw = cache.get(key)
+    if raw is None:
+        return None
+    try:
+        return Plan.model_validate(raw)
+    except ValidationError:
+        cache.evict(key)
+        return None
+
+
+def plan_cache_key(args: argparse.Namespace, pdf_path: str, pdf_bytes: PdfBuffer) -> str:
+    """
+    Cache key for one paper under the current CLI config.
+    max_words changes the prompt, so it is folded into the prompt version.
+    """
+    provider = "claude_cli" if args.use_cli else "anthropic_api"
+    model = args.claude_cmd if args.use_cli else args.model
+    return make_key(
+        provider=provider,
+        model=model,
+        prompt_version=f"{PROMPT_VERSION}:max_words={args.max_words}",
+        file_id=os.path.basename(pdf_path),
+        pdf_sha256=sha256_pdf(pdf_bytes),
+    )
+
+
+def plan_cache_meta(args: argparse.Namespace, pdf_path: str) -> Dict[str, Any]:
+    return {
+        "file_path": pdf_path,
+        "provider": "claude_cli" if args.use_cli else "anthropic_api",
+        "model": args.claude_cmd if args.use_cli else args.model,
+        "prompt_version": PROMPT_VERSION,
+        "max_words": args.max_words,
+    }
+
+
+# Parse/validation failures are fed back to Claude verbatim, up to MAX_PLAN_ATTEMPTS
+# generations in total, with a linear backoff between attempts.
+MAX_PLAN_ATTEMPTS = 3
+RETRY_BACKOFF_S = 1.0
+
+
+def retry_feedback(error: Exception) -> str:
+    return f"\n\nYour previous output failed validation: {error}. Return the corrected plan in the required format."
+
+
+def request_plan(args: argparse.Namespace, pdf_path: str, pdf_bytes: PdfBuffer) -> Plan:
+    """
+    Ask Claude (Messages API, or CLI with --use_cli) for the plan JSON and validate it.
+    """
+    if args.use_cli:
+        prompt = build_plan_prompt(pdf_path=pdf_path, max_words=args.max_words)
+
+        def generate(suffix: str = "") -> Plan:
+            output = run_claude(claude_cmd=args.claude_cmd, prompt=prompt + suffix, timeout_s=args.timeout_s)
+            return parse_plan(output)
+    else:
+        client = AnthropicClient(model=args.model, max_tokens=args.max_tokens, timeout_s=args.timeout_s)
+        user_text = build_plan_user_text(pdf_path=pdf_path, max_words=args.max_words)
+
+        def generate(suffix: str = "") -> Plan:
+            # Structured output: the tool input is already a dict, nothing to parse.
+            return Plan.model_validate(client.generate(pdf_bytes=pdf_bytes, user_text=user_text + suffix))
+
+    feedback = ""
+    for attempt in range(MAX_PLAN_ATTEMPTS):
+        try:
+            return generate(feedback)
+        except ValueError as e:  # JSON decode errors, pydantic ValidationError, missing tool call
+            if attempt == MAX_PLAN_ATTEMPTS - 1:
+                raise
+            print(f"Attempt {attempt + 1} failed validation; retrying: {e}")
+            feedback = retry_feedback(e)
+            time.sleep(RETRY_BACKOFF_S * (attempt + 1))
+    raise AssertionError("unreachable")
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(
-        description="Generate plan.md + plan_with_evidence.md from a PDF by asking Claude Code to read it directly."
+        description="Generate plan.md + plan_with_evidence.md from a PDF by asking Claude to read it."
     )
     parser.add_argument("--file_path", required=True, type=str, help="Path to input PDF.")
     parser.add_argument("--out_dir", required=True, type=str, help="Output directory for plan.md files.")
+    parser.add_argument("--model", default="claude-sonnet-4-5", type=str, help="Anthropic model for the Messages API.")
+    parser.add_argument("--max_tokens", default=8192, type=int, help="Max output tokens for the Messages API.")
+    parser.add_argument("--use_cli", action="store_true", help="Use the Claude Code CLI instead of the Messages API.")
     parser.add_argument("--claude_cmd", default="claude", type=str, help="Claude Code CLI command (optionally with flags).")
-    parser.add_argument("--timeout_s", default=1800, type=int, help="Timeout seconds for Claude CLI.")
+    parser.add_argument("--timeout_s", default=1800, type=int, help="Timeout seconds for the Claude call.")
     parser.add_argument("--max_words", default=400, type=int, help="Target maximum words for the concise content sections.")
+    parser.add_argument("--cache_dir", default=".plan_cache", type=str, help="Directory for the content-addressed plan cache.")
+    parser.add_argument("--no_cache", action="store_true", help="Always call Claude; do not read or write the plan cache.")
+    parser.add_argument("--skip_existing", action="store_true", help="Do nothing if plan.md and plan_with_evidence.md already exist in out_dir.")
     args = parser.parse_args()
 
     pdf_path = args.file_path
@@ -425,37 +824,31 @@ def main() -> None:
 
     if not os.path.exists(pdf_path):
         raise SystemExit(f"PDF not found: {pdf_path}")
+    if os.path.getsize(pdf_path) == 0:
+        raise SystemExit(f"PDF is empty: {pdf_path}")
     if not os.path.isdir(out_dir):
         os.makedirs(out_dir, exist_ok=True)
-
-    prompt = build_plan_prompt(pdf_path=pdf_path, max_words=args.max_words)
-
-    # Run Claude
-    output = run_claude(claude_cmd=args.claude_cmd, prompt=prompt, timeout_s=args.timeout_s)
-
-    # Parse JSON
-    try:
-        plan = parse_json_strict(output)
-    except Exception as e:
-        # One simple repair attempt: ask Claude to return JSON only
-        repair_prompt = prompt + "\n\nYour last output was not valid JSON. Return valid JSON ONLY."
-        output2 = run_claude(claude_cmd=args.claude_cmd, prompt=repair_prompt, timeout_s=args.timeout_s)
-        plan = parse_json_strict(output2)
-
-    # Render two markdown outputs
-    plan_md = render_plan_md_concise(plan)
-    plan_with_evidence_md = render_plan_md_with_evidence(plan)
-
-    out_plan = os.path.join(out_dir, "plan.md")
-    out_plan_e = os.path.join(out_dir, "plan_with_evidence.md")
-
-    with open(out_plan, "w", encoding="utf-8") as f:
-        f.write(plan_md)
-    with open(out_plan_e, "w", encoding="utf-8") as f:
-        f.write(plan_with_evidence_md)
-
-    print(f"Wrote: {out_plan}")
-    print(f"Wrote: {out_plan_e}")
+    if args.skip_existing and plan_outputs_exist(out_dir):
+        print(f"Skip (exists): {out_dir}")
+        return
+
+    with open_pdf_bytes(pdf_path) as pdf_bytes:
+        cache: Optional[PlanCache] = None
+        cache_key = ""
+        plan: Optional[Plan] = None
+        if not args.no_cache:
+            cache = PlanCache(args.cache_dir, schema_version=PLAN_SCHEMA_VERSION)
+            cache_key = plan_cache_key(args, pdf_path, pdf_bytes)
+            plan = load_cached_plan(cache, cache_key)
+            if plan is not None:
+                print(f"Cache hit: {cache.path(cache_key)}")
+
+        if plan is None:
+            plan = request_plan(args, pdf_path, pdf_bytes)
+            if cache is not None:
+                cache.set(cache_key, plan.model_dump(), meta=plan_cache_meta(args, pdf_path))
+
+    write_plan_outputs(plan, out_dir)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+generate_plan_batch.py
+
+Goal:
+- Input: a text file listing PDF paths (one per line; blank lines and # comments ignored)
+- Output: <out_root>/<pdf stem>/plan.md + plan_with_evidence.md for each paper
+
+All uncached papers are submitted through the Anthropic Message Batches API
+(asynchronous, half the per-token price of the synchronous Messages API), split into as
+many batches as the per-batch limits (100,000 requests / 256 MB) require. Papers already
+in the plan cache are rendered directly and never submitted.
+
+With --use_cli, the Claude Code CLI is run instead, up to --concurrency papers at a time.
+
+Usage:
+  python generate_plan_batch.py --file_list papers.txt --out_root experiments_human_repo/
+  python generate_plan_batch.py --file_list papers.txt --out_root experiments_human_repo/ --use_cli --concurrency 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from generate_plan import (
+    MAX_PLAN_ATTEMPTS,
+    PLAN_SCHEMA_VERSION,
+    RETRY_BACKOFF_S,
+    AnthropicClient,
+    Plan,
+    build_plan_prompt,
+    build_plan_user_text,
+    load_cached_plan,
+    message_plan_input,
+    open_pdf_bytes,
+    parse_plan,
+    plan_cache_key,
+    plan_cache_meta,
+    plan_outputs_exist,
+    retry_feedback,
+    run_claude_async,
+    write_plan_outputs,
+)
+from plan_cache import PlanCache
+
+
+def read_file_list(path: str) -> List[str]:
+    paths = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                paths.append(line)
+    return list(dict.fromkeys(paths))  # drop duplicates, keep order
+
+
+def paper_out_dir(out_root: str, pdf_path: str) -> str:
+    return os.path.join(out_root, os.path.splitext(os.path.basename(pdf_path))[0])
+
+
+# Message Batches API limits per batch: 100,000 requests and 256 MB of request JSON.
+# Stay well under the byte limit to leave room for the SDK's framing and headers.
+MAX_BATCH_REQUESTS = 100_000
+MAX_BATCH_BYTES = 200 * 1024 * 1024
+
+
+def iter_request_chunks(
+    client: AnthropicClient,
+    jobs: List[Tuple[str, str]],
+    max_words: int,
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Build one Messages request per (custom_id, pdf_path) job and yield them in chunks
+    that each fit into a single batch, so only one chunk of base64 payloads is held
+    in memory at a time.
+    """
+    chunk: List[Dict[str, Any]] = []
+    chunk_bytes = 0
+    for custom_id, pdf_path in jobs:
+        # Each PDF is mapped only while its base64 payload is built.
+        with open_pdf_bytes(pdf_path) as pdf_bytes:
+            params = client.message_params(pdf_bytes, build_plan_user_text(pdf_path=pdf_path, max_words=max_words))
+        request = {"custom_id": custom_id, "params": params}
+        request_bytes = len(json.dumps(request))
+        if chunk and (chunk_bytes + request_bytes > MAX_BATCH_BYTES or len(chunk) >= MAX_BATCH_REQUESTS):
+            yield chunk
+            chunk, chunk_bytes = [], 0
+        chunk.append(request)
+        chunk_bytes += request_bytes
+    if chunk:
+        yield chunk
+
+
+def iter_batch_results(
+    client: AnthropicClient,
+    jobs: List[Tuple[str, str]],
+    max_words: int,
+    poll_s: int,
+) -> Iterator[Tuple[str, Optional[Any]]]:
+    """
+    Submit the jobs as one or more batches (split by request count and payload size),
+    wait for each batch to end, then yield (custom_id, response message or None if
+    the request failed) as results stream in, so each paper can be rendered while the
+    rest are still downloading.
+    """
+    # Submit every chunk before polling so the batches are processed side by side.
+    batch_ids: List[str] = []
+    for requests in iter_request_chunks(client, jobs, max_words=max_words):
+        batch = client.client.messages.batches.create(requests=requests)
+        print(f"Submitted batch {batch.id} ({len(requests)} requests)")
+        batch_ids.append(batch.id)
+
+    for batch_id in batch_ids:
+        batch = client.client.messages.batches.retrieve(batch_id)
+        while batch.processing_status != "ended":
+            time.sleep(poll_s)
+            batch = client.client.messages.batches.retrieve(batch_id)
+            counts = batch.request_counts
+            print(f"Batch {batch.id}: {batch.processing_status} (processing={counts.processing}, succeeded={counts.succeeded}, errored={counts.errored})")
+
+        for entry in client.client.messages.batches.results(batch_id):
+            if entry.result.type == "succeeded":
+                yield entry.custom_id, entry.result.message
+            else:
+                print(f"Request {entry.custom_id} {entry.result.type}")
+                yield entry.custom_id, None
+
+
+async def process_many(
+    args: argparse.Namespace,
+    pdf_paths: List[str],
+    on_done: Callable[[str, Union[Plan, BaseException]], None],
+    concurrency: int = 8,
+) -> None:
+    """
+    Run the Claude CLI on every paper, at most `concurrency` at a time.
+    on_done(pdf_path, Plan or the exception that stopped it) runs on a worker thread
+    as soon as that paper finishes, so rendering/writing overlaps the Claude calls
+    still in flight instead of waiting for the whole gather.
+    """
+    sem = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def generate_one(pdf_path: str) -> Plan:
+        prompt = build_plan_prompt(pdf_path=pdf_path, max_words=args.max_words)
+        async with sem:
+            print(f"Running: {pdf_path}")
+            feedback = ""
+            for attempt in range(MAX_PLAN_ATTEMPTS):
+                output = await run_claude_async(args.claude_cmd, prompt + feedback, timeout_s=args.timeout_s)
+                try:
+                    return parse_plan(output)
+                except ValueError as e:  # same retry-with-feedback loop as generate_plan.py
+                    if attempt == MAX_PLAN_ATTEMPTS - 1:
+                        raise
+                    feedback = retry_feedback(e)
+                    await asyncio.sleep(RETRY_BACKOFF_S * (attempt + 1))
+            raise AssertionError("unreachable")
+
+    async def process_one(pdf_path: str) -> None:
+        result: Union[Plan, BaseException]
+        try:
+            result = await generate_one(pdf_path)
+        except Exception as e:
+            result = e
+        try:
+            await loop.run_in_executor(None, on_done, pdf_path, result)
+        except Exception as e:
+            # A failed cache/file write must not abort the gather (and cancel every
+            # CLI call still running); report it as this paper's failure instead.
+            await loop.run_in_executor(None, on_done, pdf_path, e)
+
+    await asyncio.gather(*[process_one(p) for p in pdf_paths])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Generate plan.md + plan_with_evidence.md for many PDFs via the Anthropic Message Batches API (or concurrent Claude CLI calls)."
+    )
+    parser.add_argument("--file_list", required=True, type=str, help="Text file with one PDF path per line.")
+    parser.add_argument("--out_root", required=True, type=str, help="Root directory; each paper gets <out_root>/<pdf stem>/.")
+    parser.add_argument("--model", default="claude-sonnet-4-5", type=str, help="Anthropic model for the Messages API.")
+    parser.add_argument("--max_tokens", default=8192, type=int, help="Max output tokens per request.")
+    parser.add_argument("--use_cli", action="store_true", help="Run the Claude Code CLI concurrently instead of the Batches API.")
+    parser.add_argument("--claude_cmd", default="claude", type=str, help="Claude Code CLI command (optionally with flags).")
+    parser.add_argument("--concurrency", default=8, type=int, help="Max concurrent Claude CLI processes with --use_cli.")
+    parser.add_argument("--timeout_s", default=1800, type=int, help="Timeout seconds per Claude call.")
+    parser.add_argument("--max_words", default=400, type=int, help="Target maximum words for the concise content sections.")
+    parser.add_argument("--poll_s", default=60, type=int, help="Seconds between batch status polls.")
+    parser.add_argument("--cache_dir", default=".plan_cache", type=str, help="Directory for the content-addressed plan cache.")
+    parser.add_argument("--no_cache", action="store_true", help="Submit every paper; do not read or write the plan cache.")
+    parser.add_argument("--skip_existing", action="store_true", help="Skip papers whose plan.md and plan_with_evidence.md already exist.")
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+
+    pdf_paths = read_file_list(args.file_list)
+    for pdf_path in pdf_paths:
+        if not os.path.exists(pdf_path):
+            raise SystemExit(f"PDF not found: {pdf_path}")
+        # Checked here so an empty file cannot abort the run midway (e.g. after
+        # earlier batches were already submitted).
+        if os.path.getsize(pdf_path) == 0:
+            raise SystemExit(f"PDF is empty: {pdf_path}")
+    # Output folders are named by PDF stem; two papers with the same file name would
+    # silently overwrite each other (and race on the same .tmp files under --use_cli).
+    by_out_dir: Dict[str, List[str]] = {}
+    for pdf_path in pdf_paths:
+        by_out_dir.setdefault(paper_out_dir(args.out_root, pdf_path), []).append(pdf_path)
+    clashes = [paths for paths in by_out_dir.values() if len(paths) > 1]
+    if clashes:
+        raise SystemExit(
+            "These PDFs share a file name and would write to the same output folder; rename them:\n"
+            + "\n".join("  " + ", ".join(paths) for paths in clashes)
+        )
+
+    cache: Optional[PlanCache] = None
+    if not args.no_cache:
+        cache = PlanCache(args.cache_dir, schema_version=PLAN_SCHEMA_VERSION)
+
+    # Render cached papers right away; collect the rest for Claude.
+    jobs: List[Tuple[str, str]] = []
+    keys: Dict[str, str] = {}
+    for i, pdf_path in enumerate(pdf_paths):
+        out_dir = paper_out_dir(args.out_root, pdf_path)
+        os.makedirs(out_dir, exist_ok=True)
+        if args.skip_existing and plan_outputs_exist(out_dir):
+            print(f"Skip (exists): {out_dir}")
+            continue
+
+        if cache is not None:
+            with open_pdf_bytes(pdf_path) as pdf_bytes:
+                key = plan_cache_key(args, pdf_path, pdf_bytes)
+            plan = load_cached_plan(cache, key)
+            if plan is not None:
+                print(f"Cache hit: {pdf_path}")
+                write_plan_outputs(plan, out_dir)
+                continue
+            keys[pdf_path] = key
+        jobs.append((f"paper-{i}", pdf_path))
+
+    if not jobs:
+        print("All papers cached or skipped; nothing to submit.")
+        return
+
+    failed: List[str] = []
+
+    def finish(pdf_path: str, result: Union[Plan, BaseException]) -> None:
+        if isinstance(result, BaseException):
+            print(f"Failed: {pdf_path}: {result}")
+            failed.append(pdf_path)
+            return
+        if cache is not None:
+            cache.set(keys[pdf_path], result.model_dump(), meta=plan_cache_meta(args, pdf_path))
+        write_plan_outputs(result, paper_out_dir(args.out_root, pdf_path))
+
+    if args.use_cli:
+        asyncio.run(process_many(args, [p for _, p in jobs], finish, concurrency=args.concurrency))
+    else:
+        client = AnthropicClient(model=args.model, max_tokens=args.max_tokens, timeout_s=args.timeout_s)
+        pending = dict(jobs)  # custom_id -> pdf_path
+        for custom_id, msg in iter_batch_results(client, jobs, max_words=args.max_words, poll_s=args.poll_s):
+            pdf_path = pending.pop(custom_id)
+            try:
+                if msg is None:
+                    raise RuntimeError("no successful batch result")
+                finish(pdf_path, Plan.model_validate(message_plan_input(msg)))
+            except Exception as e:
+                finish(pdf_path, e)
+        for pdf_path in pending.values():
+            finish(pdf_path, RuntimeError("missing from batch results"))
+
+    if failed:
+        raise SystemExit(f"{len(failed)} of {len(pdf_paths)} papers failed; rerun generate_plan.py on them:\n" + "\n".join(failed))
+
+
+if __name__ == "__main__":
+    main()
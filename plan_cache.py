@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+plan_cache.py
+
+Content-addressable on-disk cache for generate_plan.py.
+
+- Key: sha256 over length-prefixed (provider, model, prompt_version, file_id, pdf_sha256)
+- Value: plain JSON file <cache_dir>/<key>.json holding the parsed plan plus
+  a UTC timestamp and the config metadata that produced it.
+
+Entries written under a different schema_version are evicted on read.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Union
+
+
+def _length_prefixed(parts: list) -> bytes:
+    """
+    Concatenate parts with an 8-byte big-endian length prefix each,
+    so ("ab", "c") and ("a", "bc") never collide.
+    """
+    out = bytearray()
+    for p in parts:
+        b = p if isinstance(p, (bytes, bytearray)) else str(p).encode("utf-8")
+        out += len(b).to_bytes(8, "big")
+        out += b
+    return bytes(out)
+
+
+def sha256_pdf(pdf_bytes: Union[bytes, mmap.mmap]) -> str:
+    """
+    Length-prefixed sha256 of the raw PDF bytes (bytes or a read-only mmap).
+    """
+    h = hashlib.sha256(len(pdf_bytes).to_bytes(8, "big"))
+    h.update(pdf_bytes)
+    return h.hexdigest()
+
+
+def make_key(provider: str, model: str, prompt_version: str, file_id: str, pdf_sha256: str) -> str:
+    return hashlib.sha256(
+        _length_prefixed([provider, model, prompt_version, file_id, pdf_sha256])
+    ).hexdigest()
+
+
+class PlanCache:
+    def __init__(self, cache_dir: str, schema_version: str):
+        self.cache_dir = cache_dir
+        self.schema_version = schema_version
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the cached plan dict, or None on miss.
+        Unreadable entries and entries from another schema version are evicted.
+        """
+        p = self.path(key)
+        if not os.path.exists(p):
+            return None
+        try:
+            with open(p, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.evict(key)
+            return None
+        if not isinstance(entry, dict) or entry.get("schema_version") != self.schema_version:
+            self.evict(key)
+            return None
+        plan = entry.get("plan")
+        if not isinstance(plan, dict):
+            self.evict(key)
+            return None
+        return plan
+
+    def set(self, key: str, plan: Dict[str, Any], meta: Optional[Dict[str, Any]] = None) -> None:
+        entry = {
+            "schema_version": self.schema_version,
+            "created_utc": datetime.now(timezone.utc).isoformat(),
+            "meta": meta or {},
+            "plan": plan,
+        }
+        # Write-then-rename so readers never see a partially written entry.
+        path = self.path(key)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    def evict(self, key: str) -> None:
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass